@@ -6,3 +6,8 @@ ARCSECOND_WWW_URL_PROD = 'https://www.arcsecond.io'
 
 API_AUTH_PATH_VERIFY = 'auth/key/verify'
 API_AUTH_PATH_VERIFY_PORTAL = 'auth/key/verify-organisation'
+
+# Keep-alive connection pool shared by all endpoints of one ArcsecondAPI instance.
+API_POOL_CONNECTIONS = 16
+API_POOL_MAXSIZE = 64
+API_SEND_BLOCKSIZE = 1 << 20
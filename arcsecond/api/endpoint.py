@@ -1,3 +1,4 @@
+from typing import Optional
 from urllib.parse import urlencode
 
 import click
@@ -12,11 +13,13 @@ WRITABLE_MEMBERSHIPS = ['superadmin', 'admin', 'member']
 
 
 class ArcsecondAPIEndpoint(object):
-    def __init__(self, config: ArcsecondConfig, path: str, subdomain: str = '', subresource: str = ''):
+    def __init__(self, config: ArcsecondConfig, path: str, subdomain: str = '', subresource: str = '',
+                 session: Optional[requests.Session] = None):
         self.__config = config
         self.__path = path
         self.__subdomain = subdomain
         self.__subresource = subresource
+        self.__session = session
 
     @property
     def path(self):
@@ -72,7 +75,8 @@ class ArcsecondAPIEndpoint(object):
             click.echo(f'Sending {method_name} request to {url}')
 
         headers = self._check_and_set_auth_key(headers or {}, url)
-        method = getattr(requests, method_name.lower())
+        # A shared session keeps connections (and their TLS handshake) alive across requests.
+        method = getattr(self.__session or requests, method_name.lower())
         response = method(url, json=json, data=data, headers=headers, timeout=60)
 
         if isinstance(response, dict):
@@ -2,39 +2,72 @@
 from typing import Optional
 
 import click
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 
 from arcsecond.options import State
 from .config import ArcsecondConfig
-from .constants import API_AUTH_PATH_VERIFY
+from .constants import (
+    API_AUTH_PATH_VERIFY,
+    API_POOL_CONNECTIONS,
+    API_POOL_MAXSIZE,
+    API_SEND_BLOCKSIZE
+)
 from .endpoint import ArcsecondAPIEndpoint
 
 __all__ = ["ArcsecondAPI", ]
 
+# urllib3 < 2 does not accept a `blocksize` pool argument.
+_URLLIB3_HAS_BLOCKSIZE = int(urllib3.__version__.split('.')[0]) >= 2
+
+
+class _LargeBlockHTTPAdapter(HTTPAdapter):
+    """Send request bodies (i.e. file uploads) in large blocks instead of 16 kB ones, cutting
+    the number of read + send iterations done in Python for every uploaded file."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        if _URLLIB3_HAS_BLOCKSIZE:
+            kwargs.setdefault('blocksize', API_SEND_BLOCKSIZE)
+        super().init_poolmanager(*args, **kwargs)
+
 
 class ArcsecondAPI(object):
     def __init__(self, config: ArcsecondConfig, subdomain: str = ''):
         self.config = config
         self.subdomain = subdomain
+        self.session = self._build_session()
+
+        self.profiles = self._endpoint('profiles', self.subdomain)
 
-        self.profiles = ArcsecondAPIEndpoint(self.config, 'profiles', self.subdomain)
+        self.email = self._endpoint('profiles', subresource='email')
+        self.sharedkeys = self._endpoint('profiles', subresource='sharedkeys')
+        self.private_observingsites = self._endpoint('profiles', subresource='observingsites')
+        self.private_telescopes = self._endpoint('profiles', subresource='telescopes')
 
-        self.email = ArcsecondAPIEndpoint(self.config, 'profiles', subresource='email')
-        self.sharedkeys = ArcsecondAPIEndpoint(self.config, 'profiles', subresource='sharedkeys')
-        self.private_observingsites = ArcsecondAPIEndpoint(self.config, 'profiles', subresource='observingsites')
-        self.private_telescopes = ArcsecondAPIEndpoint(self.config, 'profiles', subresource='telescopes')
+        self.organisations = self._endpoint('organisations')  # never subdomain here
+        self.members = self._endpoint('members', self.subdomain)
 
-        self.organisations = ArcsecondAPIEndpoint(self.config, 'organisations')  # never subdomain here
-        self.members = ArcsecondAPIEndpoint(self.config, 'members', self.subdomain)
+        self.observingsites = self._endpoint('observingsites', self.subdomain)
+        self.telescopes = self._endpoint('telescopes', self.subdomain)
+        self.nightlogs = self._endpoint('nightlogs', self.subdomain)
+        self.observations = self._endpoint('observations', self.subdomain)
+        self.calibrations = self._endpoint('calibrations', self.subdomain)
 
-        self.observingsites = ArcsecondAPIEndpoint(self.config, 'observingsites', self.subdomain)
-        self.telescopes = ArcsecondAPIEndpoint(self.config, 'telescopes', self.subdomain)
-        self.nightlogs = ArcsecondAPIEndpoint(self.config, 'nightlogs', self.subdomain)
-        self.observations = ArcsecondAPIEndpoint(self.config, 'observations', self.subdomain)
-        self.calibrations = ArcsecondAPIEndpoint(self.config, 'calibrations', self.subdomain)
+        self.datapackages = self._endpoint('datapackages', self.subdomain)
+        self.datasets = self._endpoint('datasets', self.subdomain)
+        self.datafiles = self._endpoint('datafiles', self.subdomain)
 
-        self.datapackages = ArcsecondAPIEndpoint(self.config, 'datapackages', self.subdomain)
-        self.datasets = ArcsecondAPIEndpoint(self.config, 'datasets', self.subdomain)
-        self.datafiles = ArcsecondAPIEndpoint(self.config, 'datafiles', self.subdomain)
+    @classmethod
+    def _build_session(cls) -> requests.Session:
+        session = requests.Session()
+        adapter = _LargeBlockHTTPAdapter(pool_connections=API_POOL_CONNECTIONS, pool_maxsize=API_POOL_MAXSIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _endpoint(self, path: str, subdomain: str = '', subresource: str = '') -> ArcsecondAPIEndpoint:
+        return ArcsecondAPIEndpoint(self.config, path, subdomain, subresource, session=self.session)
 
     def login(self, username, access_key=None, upload_key=None):
         assert access_key or upload_key
@@ -2,6 +2,7 @@ import click
 from arcsecond.api import ArcsecondConfig
 
 from arcsecond.options import State, basic_options
+from arcsecond.uploader.constants import UPLOAD_MAX_WORKERS
 from arcsecond.uploader.context import UploadContext
 from arcsecond.uploader.utils import display_command_summary
 from arcsecond.uploader.walker import walk_folder_and_upload
@@ -9,6 +10,13 @@ from arcsecond.uploader.walker import walk_folder_and_upload
 pass_state = click.make_pass_decorator(State, ensure=True)
 
 
+def _split_tags(ctx, param, value):
+    # Custom tags are given as a single comma-separated string.
+    if value is None:
+        return None
+    return [tag.strip() for tag in value.split(',') if tag.strip()]
+
+
 @click.command(help='Upload the content of a folder.')
 @click.argument('folder', required=True, nargs=1)
 @click.option('-d', '--dataset',
@@ -21,14 +29,18 @@ pass_state = click.make_pass_decorator(State, ensure=True)
               required=True, nargs=1, type=click.BOOL,
               help="A flag indicating the data is raw or not. Default True.")
 @click.option('--tags',
-              required=False, nargs=1,
-              help="An optional list of custom tags to be attached to every filed.")
+              required=False, nargs=1, callback=_split_tags,
+              help="An optional comma-separated list of custom tags to be attached to every filed.")
 @click.option('-p', '--portal',
               required=False, nargs=1, type=click.STRING,
               help="The portal subdomain, if uploading for an Observatory Portal.")
+@click.option('-w', '--workers',
+              required=False, nargs=1, type=click.IntRange(min=1), default=UPLOAD_MAX_WORKERS,
+              help=f"The number of files uploaded concurrently. Default {UPLOAD_MAX_WORKERS}. "
+                   "The upload progress of every file is displayed only with 1.")
 @basic_options
 @pass_state
-def upload(state, folder, raw=True, tags=None, dataset=None, telescope=None, portal=None):
+def upload(state, folder, raw=True, tags=None, dataset=None, telescope=None, portal=None, workers=UPLOAD_MAX_WORKERS):
     """
     Upload the content of a folder.
 
@@ -53,7 +65,8 @@ def upload(state, folder, raw=True, tags=None, dataset=None, telescope=None, por
     account or portal.
 
     Upon validation, Arcsecond will then start walking through the folder tree and uploads regular
-     files (hidden and empty files will always be skipped).
+     files (hidden and empty files will always be skipped). Files are uploaded concurrently, use
+     `--workers 1` to upload them one by one and see the upload progress of every file.
     """
     config = ArcsecondConfig(state)
     context = UploadContext(config,
@@ -68,4 +81,4 @@ def upload(state, folder, raw=True, tags=None, dataset=None, telescope=None, por
     display_command_summary(context, [folder, ])
     ok = input('\n   ----> OK? (Press Enter) ')
     if ok.strip() == '':
-        walk_folder_and_upload(context, folder)
+        walk_folder_and_upload(context, folder, max_workers=workers)
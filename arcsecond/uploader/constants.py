@@ -23,6 +23,16 @@ DATA_EXTENSIONS = OORT_FITS_EXTENSIONS + ['.xisf', ]
 
 ZIP_EXTENSIONS = ['.zip', '.gz', '.bz2']
 
+# Client errors that are worth retrying (Request Timeout, Too Early, Too Many Requests).
+# Every other 4xx is a permanent failure.
+RETRYABLE_CLIENT_STATUSES = (408, 425, 429)
+
+# Read buffer of uploaded files. Much larger than io.DEFAULT_BUFFER_SIZE to cut read() syscalls.
+UPLOAD_BUFFER_SIZE = 1 << 20
+
+# Number of files uploaded concurrently. Small files are bound by network round-trips, not bandwidth.
+UPLOAD_MAX_WORKERS = 16
+
 
 def _extend_list(extensions):
     for zip in ZIP_EXTENSIONS:
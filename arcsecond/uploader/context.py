@@ -1,9 +1,12 @@
+import socket
+import threading
 import uuid
 from typing import Optional
 
 import click
 
 from arcsecond import ArcsecondAPI, ArcsecondConfig, ArcsecondAPIEndpoint
+from arcsecond.__version__ import __version__
 from arcsecond.api.constants import API_AUTH_PATH_VERIFY_PORTAL
 from .errors import (
     UnknownOrganisationError,
@@ -31,9 +34,14 @@ class UploadContext(object):
         self._input_dataset_uuid_or_name = str(input_dataset_uuid_or_name)
         self._input_telescope_uuid = str(input_telescope_uuid) if input_telescope_uuid else None
         self._should_update_dataset_with_telescope = False
+        # Dataset remote preparation must be done only once for all the files of the upload.
+        self._dataset_prepared = False
+        self._dataset_lock = threading.Lock()
         self._subdomain = org_subdomain
         self._is_raw_data = is_raw_data
         self._custom_tags = custom_tags
+        self._hostname = socket.gethostname()
+        self._base_tags = None
         self._dataset = None
         self._telescope = None
         self._organisation = None
@@ -45,6 +53,7 @@ class UploadContext(object):
         return self.__is_validated
 
     def validate(self):
+        # Custom tags are the same for every uploaded file, hence validated once and for all here.
         self._validate_custom_tags(self._custom_tags)
         self._validate_local_astronomer_credentials()
         self._validate_input_dataset_uuid_or_name()
@@ -59,13 +68,14 @@ class UploadContext(object):
 
     def _validate_custom_tags(self, tags=None):
         if tags is None:
-            return
+            return None
         if not isinstance(tags, list):
             raise TypeError('custom_tags must be a list')
         if not all([isinstance(t, str) for t in tags]):
             raise TypeError('all custom_tags must be strings')
         if any([t.startswith('arcsecond') for t in tags]):
             raise TypeError('none of custom_tags must start with "arcsecond"')
+        return tags
 
     def _validate_local_astronomer_credentials(self):
         username = self._config.username
@@ -182,6 +192,14 @@ class UploadContext(object):
     def update_dataset(self, dataset):
         self._dataset = dataset
 
+    def prepare_dataset_once(self, prepare):
+        # Uploaders may run concurrently: the first one to get here prepares the dataset for all the others.
+        # Should prepare() raise, the next uploader to get here will try again.
+        with self._dataset_lock:
+            if not self._dataset_prepared:
+                prepare()
+                self._dataset_prepared = True
+
     @property
     def telescope_uuid(self):
         return self._telescope.get('uuid', '') if self._telescope else ''
@@ -201,3 +219,19 @@ class UploadContext(object):
     @property
     def custom_tags(self):
         return self._custom_tags
+
+    @property
+    def hostname(self):
+        return self._hostname
+
+    @property
+    def base_tags(self):
+        # Tags common to all uploaded files. Built on first use, once the telescope is known.
+        if self._base_tags is None:
+            tags = (f'arcsecond|origin|{self._hostname}',
+                    f'arcsecond|uploader|{self._config.username}',
+                    f'arcsecond|version|{__version__}')
+            if self.telescope_uuid:
+                tags += (f'arcsecond|telescope|{self.telescope_uuid}',)
+            self._base_tags = tags
+        return self._base_tags
@@ -1,14 +1,18 @@
+import functools
 import os
-import socket
+import random
 import time
-from datetime import datetime
+import uuid
+from logging import Logger
 from pathlib import Path
+from typing import Optional
 
+import requests
 from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
 
 from arcsecond import ArcsecondAPI
-from arcsecond.__version__ import __version__
-from .constants import Status, Substatus
+from arcsecond.errors import ArcsecondError
+from .constants import RETRYABLE_CLIENT_STATUSES, UPLOAD_BUFFER_SIZE, Status, Substatus
 from .context import UploadContext
 from .errors import (
     UploadRemoteDatasetCheckError,
@@ -19,35 +23,78 @@ from .errors import (
 )
 from .logger import get_logger
 
+# Transient connection failures (DNS, refused or reset connections, connect timeouts), worth retrying.
+# Read timeouts are not: the server may have processed the upload, and a resent one would be skipped.
+_NETWORK_ERRORS = (requests.ConnectionError,)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_logger() -> Logger:
+    # Acquired once for all uploaders, but lazily: get_logger() creates the log file.
+    return get_logger(debug=True)
+
+
+class _SizedFile(object):
+    """File wrapper giving MultipartEncoder the (already known) remaining length of the file. Otherwise,
+    the encoder calls fstat() and tell() on the file for every single chunk it reads."""
+
+    def __init__(self, fh, size: int):
+        self._fh = fh
+        self._remaining = size
+
+    @property
+    def len(self) -> int:
+        return self._remaining
+
+    def read(self, length=-1) -> bytes:
+        chunk = self._fh.read(length)
+        # A file truncated during upload must not make the encoder wait forever for missing bytes.
+        self._remaining = self._remaining - len(chunk) if chunk else 0
+        return chunk
+
 
 class DataFileUploader(object):
+    # Progress bar, sliced rather than rebuilt on every print.
+    _BAR_LENGTH = 40
+    _BAR = '#' * _BAR_LENGTH
+    _SPACES = ' ' * _BAR_LENGTH
+    # Print progress every 0.5% of the file, or every 0.1 second, whichever comes first.
+    _PROGRESS_STEPS = 200
+    _PROGRESS_INTERVAL = 0.1
+
     def __init__(self,
                  context: UploadContext,
                  root_path: Path,
                  file_path: Path,
-                 display_progress: bool = False):
+                 display_progress: bool = False,
+                 api: Optional[ArcsecondAPI] = None):
         self._context = context
         self._root_path = root_path
         self._file_path = file_path
+        self._root_str = os.fspath(root_path)
+        self._log_prefix = f'[{file_path.relative_to(root_path)}]'
+        # The file does not change during upload, no need to stat() it every time.
+        self._file_size = file_path.stat().st_size
+        self._tag_root = f'arcsecond|root|{self._root_str}'
         self._display_progress = display_progress
-        self._logger = get_logger(debug=True)
+        self._logger = _get_logger()
         self._started = None
         self._progress = 0
         self._is_test_context = bool(os.environ.get('OORT_TESTS') == '1')
         self._status = [Status.NEW, Substatus.PENDING, None]
+        self._upload_fh = None
+        self._datafile = None
+        # Same key for all upload attempts, so the server can recognise retries of a request that went through.
+        self._idempotency_key = uuid.uuid4().hex
 
-        self._api = ArcsecondAPI(self._context.config, self._context.organisation_subdomain)
-
-    @property
-    def log_prefix(self) -> str:
-        return f'[{str(self._file_path.relative_to(self._root_path))}]'
-
-    @property
-    def _file_size(self) -> int:
-        return self._file_path.stat().st_size
+        # Pass a shared api to upload many files over the same pool of connections.
+        self._api = api or ArcsecondAPI(self._context.config, self._context.organisation_subdomain)
 
     def _prepare_dataset(self):
-        self._logger.info(f'{self.log_prefix} Preparing Dataset...')
+        self._context.prepare_dataset_once(self.__prepare_remote_dataset)
+
+    def __prepare_remote_dataset(self):
+        self._logger.info('%s Preparing Dataset...', self._log_prefix)
         self._status = [Status.PREPARING, Substatus.CHECKING, None]
 
         if self._context.dataset_uuid:
@@ -59,10 +106,10 @@ class DataFileUploader(object):
                 data, error = self._api.datasets.read(self._context.dataset_uuid)
 
             if error:
-                self._logger.info(f'{self.log_prefix} Dataset preparation failed..')
-                raise UploadRemoteDatasetPreparationError(str(error))
+                self._logger.info('%s Dataset preparation failed..', self._log_prefix)
+                raise UploadRemoteDatasetPreparationError(str(error), error.status)
 
-            self._logger.info(f'{self.log_prefix} Dataset preparation done.')
+            self._logger.info('%s Dataset preparation done.', self._log_prefix)
 
         elif self._context.dataset_name:
             # No valid Dataset UUID, only a name. Dataset does not exist remotely. Create it (possibly with Telescope).
@@ -72,83 +119,102 @@ class DataFileUploader(object):
 
             data, error = self._api.datasets.create(payload)
             if error:
-                self._logger.info(f'{self.log_prefix} Dataset preparation failed..')
-                raise UploadRemoteDatasetPreparationError(str(error))
+                self._logger.info('%s Dataset preparation failed..', self._log_prefix)
+                raise UploadRemoteDatasetPreparationError(str(error), error.status)
             else:
                 self._context.update_dataset(data)
 
-            self._logger.info(f'{self.log_prefix} Dataset preparation done.')
+            self._logger.info('%s Dataset preparation done.', self._log_prefix)
 
         else:
             raise UploadRemoteDatasetCheckError('No dataset specified.')
 
+    def _open_upload_file(self):
+        if self._upload_fh is None:
+            self._upload_fh = open(self._file_path, 'rb', buffering=UPLOAD_BUFFER_SIZE)
+        else:
+            # Retrying: rewind rather than opening (and leaking) another file descriptor.
+            self._upload_fh.seek(0)
+        return self._upload_fh
+
+    def _close_upload_file(self):
+        if self._upload_fh is not None:
+            self._upload_fh.close()
+            self._upload_fh = None
+
     def __get_upload_data(self):
         e = MultipartEncoder(
             fields={'dataset': self._context.dataset_uuid,
-                    'file': (self._file_path.name, open(self._file_path, 'rb'))}
+                    'file': (self._file_path.name,
+                             _SizedFile(self._open_upload_file(), self._file_size),
+                             'application/octet-stream')}
         )
 
-        def percent_printer(monitor):
-            bar_length = 40
-            self.__bytes_read = monitor.bytes_read
-            fraction = min(float(monitor.bytes_read) / float(self._file_size), 1.0)
-            hashes = '#' * int(round(fraction * bar_length))
-            spaces = ' ' * (bar_length - len(hashes))
-            print(f'[{hashes}{spaces}] {(fraction * 100):.1f}%', end='\r')
+        # The backend expects a multipart body, but without progress display there is no need
+        # for the monitor layer: requests then streams straight out of the encoder.
+        if not self._display_progress:
+            return e
 
-        m = MultipartEncoderMonitor(e, percent_printer)
+        file_size = self._file_size
+        min_step = file_size // self._PROGRESS_STEPS
+        self.__last_print_bytes = -min_step
+        self.__last_print_time = 0.0
 
-        return m
+        def percent_printer(monitor):
+            # The monitor calls back for every chunk read. Printing each time steals CPU from the upload.
+            bytes_read = monitor.bytes_read
+            now = time.monotonic()
+            if bytes_read < file_size and \
+                    bytes_read - self.__last_print_bytes < min_step and \
+                    now - self.__last_print_time < self._PROGRESS_INTERVAL:
+                return
+
+            self.__last_print_bytes = bytes_read
+            self.__last_print_time = now
+            fraction = min(float(bytes_read) / float(file_size), 1.0) if file_size > 0 else 1.0
+            n = int(round(fraction * self._BAR_LENGTH))
+            print(f'[{self._BAR[:n]}{self._SPACES[:self._BAR_LENGTH - n]}] {(fraction * 100):.1f}%', end='\r')
+
+        return MultipartEncoderMonitor(e, percent_printer)
 
     def _perform_upload(self):
-        self._logger.info(f'{self.log_prefix} Start uploading...')
+        self._logger.info('%s Start uploading...', self._log_prefix)
         self._status = [Status.UPLOADING, Substatus.UPLOADING, None]
 
-        self._started = datetime.now()
-        self._logger.info(f'{self.log_prefix} Starting upload to Arcsecond ({self._file_size} bytes)')
+        self._started = time.monotonic()
+        self._logger.info('%s Starting upload to Arcsecond (%s bytes)', self._log_prefix, self._file_size)
 
         data = self.__get_upload_data()
-        self._datafile, error = self._api.datafiles.create(data=data, headers={"Content-Type": data.content_type})
+        headers = {'Content-Type': data.content_type, 'Idempotency-Key': self._idempotency_key}
+        self._datafile, error = self._api.datafiles.create(data=data, headers=headers)
         if not error:
-            seconds = (datetime.now() - self._started).total_seconds()
-            self._logger.info(f'{self.log_prefix} Upload duration is {seconds} seconds.')
+            seconds = time.monotonic() - self._started
+            self._logger.info('%s Upload duration is %s seconds.', self._log_prefix, seconds)
             return
 
-        if 'already exists in dataset' in str(error):  # VERY WEAK!!! But solution with HTTP 409 isn't nice either.
+        # A file already in the dataset is a 409 Conflict. Fall back on the error message for servers answering 400.
+        if error.status == 409 or 'already exists in dataset' in error.message:
             self._status = [Status.SKIPPED, Substatus.ALREADY_SYNCED, None]
         else:
             self._status = [Status.ERROR, Substatus.ERROR, None]
-            self._logger.info(f'{self.log_prefix} Upload of file {self._file_path} failed.')
-            raise UploadRemoteFileError(f"{str(error.status)} - {str(error)}")
+            self._logger.info('%s Upload of file %s failed.', self._log_prefix, self._file_path)
+            raise UploadRemoteFileError(f"{str(error.status)} - {str(error)}", error.status)
 
     def _update_file_metadata(self, is_raw=None, custom_tags=None):
-        self._logger.info(f'{self.log_prefix} Updating file metadata....')
+        self._logger.info('%s Updating file metadata....', self._log_prefix)
         self._status = [Status.FINISHING, Substatus.TAGGING, None]
 
-        tag_root = f'arcsecond|root|{str(self._root_path)}'
-        tag_origin = f'arcsecond|origin|{socket.gethostname()}'
-        tag_uploader = f'arcsecond|uploader|{self._context.config.username}'
-        tag_version = f'arcsecond|version|{__version__}'
-        tags = [tag_root, tag_origin, tag_uploader, tag_version]
-
-        if self._context.telescope_uuid:
-            tag_telescope = f'arcsecond|telescope|{self._context.telescope_uuid}'
-            tags.append(tag_telescope)
-
-        if custom_tags is not None:
-            # Just in case...
-            self._context._validate_custom_tags(custom_tags)
-            tags.extend(custom_tags)
-        elif self._context.custom_tags is not None:
-            tags.extend(self._context.custom_tags)
+        # Both custom tags sources are already validated.
+        custom_tags = custom_tags if custom_tags is not None else self._context.custom_tags or []
+        tags = (self._tag_root,) + self._context.base_tags + tuple(custom_tags)
 
         is_raw_flag = is_raw if is_raw is not None else self._context.is_raw_data
 
         payload = {
             'tags': tags,
             'is_raw': is_raw_flag,
-            'fsname': socket.gethostname(),
-            'fspath': str(self._root_path)
+            'fsname': self._context.hostname,
+            'fspath': self._root_str
         }
 
         # Tags being a list, they cannot be part of the MultipartEncoder.fields because they will
@@ -156,42 +222,55 @@ class DataFileUploader(object):
         data, error = self._api.datafiles.update(self._datafile.get('pk'), json=payload)
         if error:
             self._status = [Status.ERROR, Substatus.ERROR, None]
-            self._logger.info(f'{self.log_prefix} Update of metadata failed.')
-            raise UploadRemoteFileMetadataError(str(error))
+            self._logger.info('%s Update of metadata failed.', self._log_prefix)
+            raise UploadRemoteFileMetadataError(str(error), error.status)
         else:
             self._status = [Status.OK, Substatus.DONE, None]
 
+    @classmethod
+    def _is_retryable(cls, error: Exception) -> bool:
+        if not isinstance(error, ArcsecondError):
+            return True
+        return not (400 <= error.status < 500) or error.status in RETRYABLE_CLIENT_STATUSES
+
+    def _retry(self, fn, *, attempts=5, base=2.0, cap=240.0, exceptions):
+        """Call fn(), retrying on the given exceptions with a capped and jittered exponential
+        back-off. Connection errors are always retried, and permanent client errors (4xx, except 408,
+        425 and 429) never are."""
+        for attempt in range(attempts):
+            try:
+                return fn()
+            except exceptions as error:
+                if attempt == attempts - 1 or not self._is_retryable(error):
+                    raise
+                delay = min(cap, base * 2 ** attempt) + random.uniform(0, base)
+                reason = error.status if isinstance(error, ArcsecondError) else type(error).__name__
+                self._logger.info('%s Failed (%s). Retrying in %.1f seconds...', self._log_prefix, reason, delay)
+                time.sleep(delay)
+
     def upload_file(self, is_raw=None, custom_tags=None):
-        self._logger.info(f'{self.log_prefix} Opening upload sequence.')
+        self._logger.info('%s Opening upload sequence.', self._log_prefix)
         if self._context.is_validated is False:
             raise UploadRemoteFileInvalidatedContextError()
 
-        try:
-            self._prepare_dataset()
-        except UploadRemoteDatasetPreparationError:
-            # Just try again. Note, only `UploadRemoteDatasetPreparationError` is caught,
-            # and not `UploadRemoteDatasetCheckError`.
-            time.sleep(1)
-            self._prepare_dataset()
+        if custom_tags is not None:
+            # Custom tags overriding the context ones for this file only. Validated once, not on every retry.
+            custom_tags = self._context._validate_custom_tags(custom_tags)
 
+        # Note, only `UploadRemoteDatasetPreparationError` is retried, and not `UploadRemoteDatasetCheckError`.
+        self._retry(self._prepare_dataset, exceptions=(UploadRemoteDatasetPreparationError, *_NETWORK_ERRORS))
         try:
-            self._perform_upload()
-        except UploadRemoteFileError:
-            # Just try again
-            time.sleep(1)
-            self._perform_upload()
+            self._retry(self._perform_upload, exceptions=(UploadRemoteFileError, *_NETWORK_ERRORS))
+        finally:
+            self._close_upload_file()
 
         if self._status[0] == Status.SKIPPED:
-            self._logger.info(f'{self.log_prefix} Upload skipped.')
+            self._logger.info('%s Upload skipped.', self._log_prefix)
         else:
-            self._logger.info(f'{self.log_prefix} Upload done.')
+            self._logger.info('%s Upload done.', self._log_prefix)
 
-            try:
-                self._update_file_metadata(is_raw=is_raw, custom_tags=custom_tags)
-            except UploadRemoteFileMetadataError:
-                # Just try again
-                time.sleep(1)
-                self._update_file_metadata(is_raw=is_raw, custom_tags=custom_tags)
+            self._retry(lambda: self._update_file_metadata(is_raw=is_raw, custom_tags=custom_tags),
+                        exceptions=(UploadRemoteFileMetadataError, *_NETWORK_ERRORS))
 
-        self._logger.info(f'{self.log_prefix} Closing upload sequence.')
+        self._logger.info('%s Closing upload sequence.', self._log_prefix)
         return self._status
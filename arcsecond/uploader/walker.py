@@ -1,9 +1,13 @@
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import click
+import requests
 
-from .constants import Status
+from arcsecond.api import ArcsecondAPI
+from arcsecond.errors import ArcsecondError
+from .constants import Status, Substatus, UPLOAD_MAX_WORKERS
 from .context import UploadContext
 from .logger import get_logger
 from .uploader import DataFileUploader
@@ -39,27 +43,55 @@ def __walk_first_pass(context: UploadContext, root_path: Path):
     return file_paths
 
 
-def __walk_second_pass(context: UploadContext, root_path: Path, file_paths: list):
+def __upload_file(context: UploadContext, root_path: Path, file_path: Path, display_progress: bool, api: ArcsecondAPI):
+    # Within a thread pool, an exception would only surface once every queued file has been uploaded,
+    # and would then lose the summary of the walk. Record the file as failed instead. The uploader is built
+    # here too, as the file may have been removed since the first pass.
+    try:
+        uploader = DataFileUploader(context, root_path, file_path, display_progress=display_progress, api=api)
+        return uploader.upload_file()
+    except (ArcsecondError, requests.RequestException, OSError) as error:
+        return Status.ERROR, Substatus.ERROR, str(error)
+
+
+def __walk_second_pass(context: UploadContext, root_path: Path, file_paths: list, max_workers: int):
     logger = get_logger()
     log_prefix = '[Walker - 2/2]'
     logger.info(f"{log_prefix} Starting second pass to upload files...")
 
     uploads = {'succeeded': [], 'skipped': [], 'failed': []}
     total_file_count = len(file_paths)
-
-    index = 0
-    for file_path in file_paths:
-        index += 1
-        click.echo(f"{log_prefix} File {index} / {total_file_count} ({index / total_file_count * 100:.2f}%)")
-
-        uploader = DataFileUploader(context, root_path, file_path, display_progress=True)
-        status, substatus, error = uploader.upload_file()
-        if status == Status.OK:
-            uploads['succeeded'].append(str(file_path))
-        elif status == Status.SKIPPED:
-            uploads['skipped'].append((str(file_path), substatus, error))
-        else:
-            uploads['failed'].append((str(file_path), substatus, error))
+    # One API client (hence one connection pool) for all the files of the walk.
+    api = ArcsecondAPI(context.config, context.organisation_subdomain)
+    # Progress bars of concurrent uploads would overwrite each other.
+    display_progress = max_workers == 1
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            futures = {}
+            for file_path in file_paths:
+                future = executor.submit(__upload_file, context, root_path, file_path, display_progress, api)
+                futures[future] = file_path
+
+            index = 0
+            for future in as_completed(futures):
+                file_path = futures[future]
+                index += 1
+                msg = f"{log_prefix} File {index} / {total_file_count} ({index / total_file_count * 100:.2f}%) "
+                msg += f"{file_path.name}"
+                click.echo(msg)
+
+                status, substatus, error = future.result()
+                if status == Status.OK:
+                    uploads['succeeded'].append(str(file_path))
+                elif status == Status.SKIPPED:
+                    uploads['skipped'].append((str(file_path), substatus, error))
+                else:
+                    uploads['failed'].append((str(file_path), substatus, error))
+        except BaseException:
+            # Ctrl-C or unexpected error: drop the queued uploads, only those in progress are waited for.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
     msg = f"{log_prefix}\n\nFinished upload walk inside folder {root_path} "
     logger.info(msg)
@@ -67,7 +99,7 @@ def __walk_second_pass(context: UploadContext, root_path: Path, file_paths: list
     return uploads
 
 
-def walk_folder_and_upload(context: UploadContext, folder_string: str):
+def walk_folder_and_upload(context: UploadContext, folder_string: str, max_workers: int = UPLOAD_MAX_WORKERS):
     logger = get_logger()
     log_prefix = '[Walker]'
     root_path = Path(folder_string).resolve()
@@ -91,7 +123,7 @@ def walk_folder_and_upload(context: UploadContext, folder_string: str):
         logger.error(f"Exiting.")
         return
 
-    uploads = __walk_second_pass(context, root_path, file_paths)
+    uploads = __walk_second_pass(context, root_path, file_paths, max_workers)
     msg = f"{log_prefix} uploads succeeded: {len(uploads['succeeded'])}, "
     msg += f"skipped: {len(uploads['skipped'])}, failed: {len(uploads['failed'])}\n"
     logger.info(msg)
@@ -0,0 +1,381 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import as_completed
+
+import httpretty
+import pytest
+import requests
+from click.testing import CliRunner
+
+from arcsecond import ArcsecondConfig
+from arcsecond.__version__ import __version__
+from arcsecond.api.constants import ARCSECOND_API_URL_DEV
+from arcsecond.cloud import uploads
+from arcsecond.options import State
+from arcsecond.uploader.constants import Status, Substatus
+from arcsecond.uploader import uploader, walker
+from arcsecond.uploader.context import UploadContext
+from arcsecond.uploader.errors import UploadRemoteFileError
+from arcsecond.uploader.uploader import DataFileUploader
+from tests.utils import TEST_LOGIN_USERNAME, TEST_UPLOAD_KEY, clear_test_credentials
+
+DATASET_UUID = 'd0f0a7e6-1b59-4b5c-9c3e-2d3f4a5b6c7d'
+TELESCOPE_UUID = '5e6f7a8b-9c0d-4e1f-8a2b-3c4d5e6f7a8b'
+
+
+class FakeAPIServer(object):
+    """Registers the datasets, telescopes and datafiles routes, and records the requests made."""
+
+    def __init__(self, datafile_post_statuses=None, dataset=None):
+        self.requests = []
+        self.metadata_payloads = []
+        self.datafile_posts = []
+        self._lock = threading.Lock()
+        self._datafile_post_statuses = list(datafile_post_statuses or [])
+        self._dataset = dataset or {'uuid': DATASET_UUID, 'name': 'Dataset', 'telescope': TELESCOPE_UUID}
+
+        for method in [httpretty.GET, httpretty.POST, httpretty.PATCH]:
+            httpretty.register_uri(method, re.compile(ARCSECOND_API_URL_DEV + r'/\w+/.*'), body=self._respond)
+
+    def count(self, method, path):
+        return len([r for r in self.requests if r == (method, path)])
+
+    def _respond(self, request, uri, response_headers):
+        path = uri.split(ARCSECOND_API_URL_DEV)[-1].split('/')[1]
+        with self._lock:
+            self.requests.append((request.method, path))
+            if path == 'datafiles' and request.method == 'POST':
+                self.datafile_posts.append(request)
+                status = self._datafile_post_statuses.pop(0) if self._datafile_post_statuses else 201
+                return [status, response_headers, json.dumps({'pk': len(self.requests)})]
+            if path == 'datafiles' and request.method == 'PATCH':
+                self.metadata_payloads.append(json.loads(request.body))
+                return [200, response_headers, '{}']
+            if path == 'datasets' and request.method == 'GET' and '?' in uri:
+                return [200, response_headers, '[]']
+            if path == 'datasets' and request.method == 'POST':
+                self._dataset = dict(json.loads(request.body), uuid=DATASET_UUID)
+                return [201, response_headers, json.dumps(self._dataset)]
+            if path == 'telescopes':
+                return [200, response_headers, json.dumps({'uuid': TELESCOPE_UUID})]
+            return [200, response_headers, json.dumps(self._dataset)]
+
+
+@pytest.fixture(autouse=True)
+def test_logger(monkeypatch):
+    # No upload log file during tests. The uploaders' logger is cached, hence acquired again with the test env.
+    monkeypatch.setenv('OORT_TESTS', '1')
+    uploader._get_logger.cache_clear()
+    yield
+    uploader._get_logger.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def serialized_http(monkeypatch):
+    # httpretty keeps the request being answered on the registered entry, hence concurrent requests
+    # to the same route get mixed up. Uploads still run in worker threads, only the HTTP exchanges are serialized.
+    lock = threading.Lock()
+    send = requests.Session.send
+
+    def serialized_send(session, request, **kwargs):
+        with lock:
+            return send(session, request, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'send', serialized_send)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr('arcsecond.uploader.uploader.time.sleep', delays.append)
+    return delays
+
+
+def make_context(dataset=DATASET_UUID, telescope=None, custom_tags=None):
+    clear_test_credentials()
+    config = ArcsecondConfig(State(api_name='test'))
+    config.api_server = ARCSECOND_API_URL_DEV
+    config.save(username=TEST_LOGIN_USERNAME, upload_key=TEST_UPLOAD_KEY)
+    context = UploadContext(config, dataset, input_telescope_uuid=telescope, custom_tags=custom_tags)
+    context.validate()
+    return context
+
+
+def make_files(folder, count):
+    paths = []
+    for i in range(count):
+        path = folder / f'file{i}.fits'
+        path.write_bytes(os.urandom(1024))
+        paths.append(path)
+    return paths
+
+
+def walk_second_pass(context, root_path, file_paths, max_workers=4):
+    return getattr(walker, '__walk_second_pass')(context, root_path, file_paths, max_workers)
+
+
+@httpretty.activate
+def test_walk_uploads_all_files_concurrently(tmp_path, sleeps):
+    server = FakeAPIServer()
+    context = make_context()
+    file_paths = make_files(tmp_path, 8)
+
+    uploads = walk_second_pass(context, tmp_path, file_paths)
+
+    assert sorted(uploads['succeeded']) == sorted(str(p) for p in file_paths)
+    assert uploads['skipped'] == [] and uploads['failed'] == []
+    assert server.count('POST', 'datafiles') == 8
+    assert server.count('PATCH', 'datafiles') == 8
+
+
+@httpretty.activate
+def test_walk_records_network_errors_as_failed(tmp_path, sleeps, monkeypatch):
+    FakeAPIServer()
+    context = make_context()
+    file_paths = make_files(tmp_path, 6)
+    broken_path = file_paths[0]
+    attempts = []
+
+    perform_upload = DataFileUploader._perform_upload
+
+    def flaky_perform_upload(file_uploader):
+        if file_uploader._file_path == broken_path:
+            attempts.append(1)
+            raise requests.ConnectionError('Connection reset by peer')
+        return perform_upload(file_uploader)
+
+    monkeypatch.setattr(DataFileUploader, '_perform_upload', flaky_perform_upload)
+
+    uploads = walk_second_pass(context, tmp_path, file_paths, max_workers=2)
+
+    assert len(attempts) == 5
+    assert len(uploads['succeeded']) == 5
+    assert [(path, substatus) for path, substatus, _ in uploads['failed']] == [(str(broken_path), Substatus.ERROR)]
+
+
+@httpretty.activate
+def test_walk_creates_new_dataset_only_once(tmp_path, sleeps):
+    server = FakeAPIServer(dataset={})
+    context = make_context(dataset='New Dataset', telescope=TELESCOPE_UUID)
+    file_paths = make_files(tmp_path, 8)
+
+    uploads = walk_second_pass(context, tmp_path, file_paths)
+
+    assert len(uploads['succeeded']) == 8
+    assert server.count('POST', 'datasets') == 1
+    assert context.dataset_uuid == DATASET_UUID
+
+
+@httpretty.activate
+def test_upload_permanent_client_error_is_not_retried(tmp_path, sleeps):
+    server = FakeAPIServer(datafile_post_statuses=[403])
+    context = make_context()
+    file_path, = make_files(tmp_path, 1)
+
+    file_uploader = DataFileUploader(context, tmp_path, file_path)
+    with pytest.raises(UploadRemoteFileError):
+        file_uploader.upload_file()
+
+    assert server.count('POST', 'datafiles') == 1
+    assert sleeps == []
+
+
+@httpretty.activate
+def test_upload_transient_errors_are_retried_with_backoff(tmp_path, sleeps):
+    server = FakeAPIServer(datafile_post_statuses=[429, 503])
+    context = make_context()
+    file_path, = make_files(tmp_path, 1)
+
+    status, substatus, error = DataFileUploader(context, tmp_path, file_path).upload_file()
+
+    assert status == Status.OK
+    assert server.count('POST', 'datafiles') == 3
+    assert len(sleeps) == 2
+    assert 2 <= sleeps[0] <= 4 and 4 <= sleeps[1] <= 6
+
+
+@httpretty.activate
+def test_upload_read_timeout_is_not_retried(tmp_path, sleeps, monkeypatch):
+    FakeAPIServer()
+    context = make_context()
+    file_path, = make_files(tmp_path, 1)
+    attempts = []
+
+    def timed_out_perform_upload(file_uploader):
+        attempts.append(1)
+        raise requests.ReadTimeout('Read timed out')
+
+    monkeypatch.setattr(DataFileUploader, '_perform_upload', timed_out_perform_upload)
+
+    uploads = walk_second_pass(context, tmp_path, [file_path])
+
+    assert len(attempts) == 1
+    assert sleeps == []
+    assert [(path, substatus) for path, substatus, _ in uploads['failed']] == [(str(file_path), Substatus.ERROR)]
+
+
+@httpretty.activate
+def test_upload_retry_reuses_and_closes_the_file(tmp_path, sleeps, monkeypatch):
+    server = FakeAPIServer(datafile_post_statuses=[503])
+    context = make_context()
+    file_path, = make_files(tmp_path, 1)
+    opened = []
+
+    def counting_open(*args, **kwargs):
+        opened.append(open(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(uploader, 'open', counting_open, raising=False)
+
+    file_uploader = DataFileUploader(context, tmp_path, file_path)
+    status, substatus, error = file_uploader.upload_file()
+
+    assert status == Status.OK
+    assert server.count('POST', 'datafiles') == 2
+    assert len(opened) == 1 and opened[0].closed
+    assert file_uploader._upload_fh is None
+
+
+@httpretty.activate
+def test_existing_dataset_is_prepared_once(tmp_path, sleeps):
+    server = FakeAPIServer()
+    context = make_context()
+    file_paths = make_files(tmp_path, 3)
+    # One read to validate the context.
+    assert server.count('GET', 'datasets') == 1
+
+    for file_path in file_paths:
+        DataFileUploader(context, tmp_path, file_path).upload_file()
+
+    assert server.count('GET', 'datasets') == 2
+
+
+@httpretty.activate
+def test_walk_records_files_removed_since_first_pass_as_failed(tmp_path, sleeps):
+    server = FakeAPIServer()
+    context = make_context()
+    file_paths = make_files(tmp_path, 4)
+    removed_path = file_paths[0]
+    removed_path.unlink()
+
+    uploads = walk_second_pass(context, tmp_path, file_paths)
+
+    assert len(uploads['succeeded']) == 3
+    assert [(path, substatus) for path, substatus, _ in uploads['failed']] == [(str(removed_path), Substatus.ERROR)]
+    assert server.count('POST', 'datafiles') == 3
+
+
+@httpretty.activate
+def test_walk_interrupted_cancels_queued_uploads(tmp_path, sleeps, monkeypatch):
+    FakeAPIServer()
+    context = make_context()
+    file_paths = make_files(tmp_path, 8)
+    collecting = threading.Event()
+    uploaded = []
+
+    def collecting_as_completed(futures):
+        collecting.set()
+        return as_completed(futures)
+
+    def interrupted_upload_file(file_uploader, *args, **kwargs):
+        uploaded.append(file_uploader._file_path)
+        if len(uploaded) == 1:
+            # Interrupt once all the uploads have been queued.
+            collecting.wait()
+            raise KeyboardInterrupt()
+        threading.Event().wait(0.1)
+        return Status.OK, Substatus.DONE, None
+
+    monkeypatch.setattr(walker, 'as_completed', collecting_as_completed)
+    monkeypatch.setattr(DataFileUploader, 'upload_file', interrupted_upload_file)
+
+    with pytest.raises(KeyboardInterrupt):
+        walk_second_pass(context, tmp_path, file_paths, max_workers=1)
+
+    assert len(uploaded) < len(file_paths)
+
+
+@httpretty.activate
+def test_upload_conflict_is_skipped(tmp_path, sleeps):
+    server = FakeAPIServer(datafile_post_statuses=[409])
+    context = make_context()
+    file_path, = make_files(tmp_path, 1)
+
+    status, substatus, error = DataFileUploader(context, tmp_path, file_path).upload_file()
+
+    assert (status, substatus) == (Status.SKIPPED, Substatus.ALREADY_SYNCED)
+    assert server.count('PATCH', 'datafiles') == 0
+    assert sleeps == []
+
+
+@httpretty.activate
+def test_upload_retries_send_the_same_idempotency_key(tmp_path, sleeps):
+    server = FakeAPIServer(datafile_post_statuses=[503])
+    context = make_context()
+    file_path, = make_files(tmp_path, 1)
+
+    DataFileUploader(context, tmp_path, file_path).upload_file()
+
+    keys = [request.headers.get('Idempotency-Key') for request in server.datafile_posts]
+    assert len(keys) == 2
+    assert keys[0] and keys[0] == keys[1]
+
+
+@httpretty.activate
+def test_upload_body_matches_its_announced_length(tmp_path, sleeps):
+    server = FakeAPIServer(datafile_post_statuses=[503])
+    context = make_context()
+    file_path, = make_files(tmp_path, 1)
+    # Larger than one encoder chunk, to cover successive reads.
+    file_path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+
+    DataFileUploader(context, tmp_path, file_path).upload_file()
+
+    # The retry rewinds the file, and sends the full body again.
+    first_post, second_post = server.datafile_posts
+    for request in server.datafile_posts:
+        assert int(request.headers['Content-Length']) == len(request.body)
+        assert file_path.read_bytes() in request.body
+    assert len(first_post.body) == len(second_post.body)
+
+
+def test_custom_tags_are_validated_with_the_context():
+    context = UploadContext(ArcsecondConfig(State(api_name='test')), DATASET_UUID, custom_tags=['arcsecond|root|x'])
+    with pytest.raises(TypeError):
+        context.validate()
+
+
+def test_custom_tags_from_cli_string(monkeypatch):
+    contexts = []
+
+    def fake_context(config, **kwargs):
+        contexts.append(kwargs)
+        raise RuntimeError('stop before validation')
+
+    monkeypatch.setattr(uploads, 'UploadContext', fake_context)
+    args = ['folder', '-d', DATASET_UUID, '-t', TELESCOPE_UUID, '--raw', 'true', '--tags', 'a, b,,c ']
+    CliRunner().invoke(uploads.upload, args)
+
+    assert contexts[0]['custom_tags'] == ['a', 'b', 'c']
+
+
+@httpretty.activate
+def test_metadata_tags_order(tmp_path, sleeps):
+    server = FakeAPIServer()
+    context = make_context(telescope=TELESCOPE_UUID, custom_tags=['tag1', 'tag2'])
+    file_path, = make_files(tmp_path, 1)
+
+    DataFileUploader(context, tmp_path, file_path).upload_file()
+
+    payload, = server.metadata_payloads
+    assert payload['tags'] == [f'arcsecond|root|{tmp_path}',
+                               f'arcsecond|origin|{context.hostname}',
+                               f'arcsecond|uploader|{TEST_LOGIN_USERNAME}',
+                               f'arcsecond|version|{__version__}',
+                               f'arcsecond|telescope|{TELESCOPE_UUID}',
+                               'tag1',
+                               'tag2']
+    assert payload['fspath'] == str(tmp_path)
+    assert payload['is_raw'] is True